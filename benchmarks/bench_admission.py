@@ -0,0 +1,136 @@
+"""Test obciążeniowy kontroli dopuszczania: klienci raportów odpytują w pętli
+/api/platnosci/by-date, a kasjer co chwilę zapisuje płatność. Porównuje opóźnienie zapisu
+(p50/p99) z wyłączoną (ADMISSION_CONTROL=0) i włączoną kontrolą dopuszczania.
+
+Uruchomienie (z katalogu głównego projektu):
+    python benchmarks/bench_admission.py [liczba_płatności_w_pliku] [czas_pomiaru_s]
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "hipokrates"
+REPORT_CLIENTS = 16
+SAVE_INTERVAL = 0.25
+SAVE_P99_TARGET_MS = float(os.getenv("SAVE_P99_TARGET_MS", "1500"))
+
+
+def write_ledger(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("UID;DATA;BADANIA;KWOTA;UWAGI\n")
+        for i in range(rows):
+            f.write(f"bench{i};{1 + i % 28:02d}.10.2026, 10:{i % 60:02d}:00;218|223|160;402,0;\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, admission):
+    port = free_port()
+    env = dict(os.environ, ENVIRONMENT="development", LOG_SAMPLE_RATE="0", ADMIN_PASSWORD=PASSWORD,
+               ADMISSION_CONTROL="1" if admission else "0")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", PROJECT_DIR, "--host", "127.0.0.1",
+         "--port", str(port), "--no-access-log", "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.post(f"{base_url}/api/login", json={"password": PASSWORD}).status_code == 200:
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    return proc, base_url
+
+
+def login(base_url):
+    c = httpx.Client(base_url=base_url, timeout=120)
+    c.post("/api/login", json={"password": PASSWORD})
+    return c
+
+
+def report_client(base_url, stop, counters):
+    c = login(base_url)
+    day = 1
+    while not stop.is_set():
+        response = c.get("/api/platnosci/by-date", params={"date": f"2026-10-{day:02d}"})
+        counters[response.status_code] = counters.get(response.status_code, 0) + 1
+        if response.status_code == 429:
+            time.sleep(float(response.headers.get("Retry-After", "1")))
+        day = day % 28 + 1
+    c.close()
+
+
+def cashier(base_url, stop, latencies):
+    c = login(base_url)
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = c.post("/api/platnosci/save", json={
+            "uid": f"save{os.getpid()}-{time.time_ns()}-{i}", "data": "19.10.2026, 12:00:00",
+            "badania": "1", "kwota": 10.0
+        })
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        i += 1
+        time.sleep(SAVE_INTERVAL)
+    c.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+def run(workdir, admission, duration):
+    proc, base_url = start_server(workdir, admission)
+    stop = threading.Event()
+    counters = {}
+    latencies = []
+    threads = [threading.Thread(target=report_client, args=(base_url, stop, counters)) for _ in range(REPORT_CLIENTS)]
+    threads.append(threading.Thread(target=cashier, args=(base_url, stop, latencies)))
+    try:
+        for t in threads:
+            t.start()
+        time.sleep(duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+    return latencies, counters
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"plik płatności: {rows} wierszy, {REPORT_CLIENTS} klientów raportów, zapis co {SAVE_INTERVAL} s, "
+          f"{duration:.0f} s na pomiar, cel p99 zapisu {SAVE_P99_TARGET_MS:.0f} ms")
+    for admission in (False, True):
+        with tempfile.TemporaryDirectory() as workdir:
+            write_ledger(os.path.join(workdir, "platnosci.csv"), rows)
+            open(os.path.join(workdir, "badania.csv"), "w").write("KOD;NAZWA BADANIA;KWOTA;KWOTA 2\n")
+            latencies, counters = run(workdir, admission, duration)
+        p50 = percentile(latencies, 0.5) * 1000
+        p99 = percentile(latencies, 0.99) * 1000
+        verdict = "OK" if p99 <= SAVE_P99_TARGET_MS else "powyżej celu"
+        print(f"  kontrola dopuszczania {'włączona' if admission else 'wyłączona'}: "
+              f"zapisy {len(latencies)}, p50 {p50:.0f} ms, p99 {p99:.0f} ms ({verdict}); "
+              f"raporty: {dict(sorted(counters.items()))}")
+
+
+if __name__ == "__main__":
+    main()
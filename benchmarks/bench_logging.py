@@ -0,0 +1,107 @@
+"""Porównanie kosztu logowania w wątku żądania: dotychczasowy logging.basicConfig
+(StreamHandler, f-string) vs kolejkowy handler z JSON i próbkowaniem (main.configure_logging).
+
+Uruchomienie (z katalogu głównego projektu):
+    python benchmarks/bench_logging.py [liczba_rekordów]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("ENVIRONMENT", "development")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+SINK_DELAY = 0.00005  # Symulowane opóźnienie zapisu jednej linii (np. zapchany pipe stdout)
+
+
+class SlowStream:
+    """Strumień, który dopisuje do pliku z opóźnieniem na każdą linię"""
+
+    def __init__(self, f, delay):
+        self.f = f
+        self.delay = delay
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+
+def run(logger, n):
+    """Loguje n zdarzeń wyszukiwania (próbkowanych) i co setne ostrzeżenie"""
+    start = time.perf_counter()
+    for i in range(n):
+        query = f"morfologia {i}"
+        if i % 100 == 0:
+            logger.warning(f"Nieprawidłowe hasło z IP: 10.0.0.{i % 255}")
+        logger.info("Wyszukiwanie: %s...", query[:50], extra={"sample": True})
+    return time.perf_counter() - start
+
+
+def bench_basic(path, n, delay):
+    reset_root()
+    with open(path, "w") as f:
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            stream=SlowStream(f, delay),
+            force=True
+        )
+        logger = logging.getLogger("bench")
+        start = time.perf_counter()
+        for i in range(n):
+            query = f"morfologia {i}"
+            if i % 100 == 0:
+                logger.warning(f"Nieprawidłowe hasło z IP: 10.0.0.{i % 255}")
+            logger.info(f"Wyszukiwanie: {query[:50]}...")
+        elapsed = time.perf_counter() - start
+    return elapsed
+
+
+def bench_queue(path, n, delay):
+    reset_root()
+    main.LOG_JSON = True
+    with open(path, "w") as f:
+        listener = main.configure_logging(SlowStream(f, delay))
+        logger = logging.getLogger("bench")
+        elapsed = run(logger, n)
+        # Poczekaj aż wątek w tle zapisze wszystkie rekordy
+        listener.stop()
+    return elapsed
+
+
+def count_lines(path):
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def main_bench():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    main.log_listener.stop()
+    with tempfile.TemporaryDirectory() as tmp:
+        for delay in (0, SINK_DELAY):
+            basic_path = os.path.join(tmp, "basic.log")
+            queue_path = os.path.join(tmp, "queue.log")
+            basic_time = bench_basic(basic_path, n, delay)
+            queue_time = bench_queue(queue_path, n, delay)
+            print(f"opóźnienie zapisu {delay * 1e6:.0f} µs/linia, {n} zdarzeń INFO + {n // 100} WARNING:", file=sys.stderr)
+            print(f"  basicConfig:  {basic_time * 1e6 / n:8.2f} µs/zdarzenie w wątku żądania, {count_lines(basic_path)} linii", file=sys.stderr)
+            print(f"  kolejka+JSON: {queue_time * 1e6 / n:8.2f} µs/zdarzenie w wątku żądania, {count_lines(queue_path)} linii "
+                  f"(próbkowanie {main.LOG_SAMPLE_RATE})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,102 @@
+"""Przepustowość przy różnej liczbie workerów uvicorn ze współdzielonym snapshotem katalogu
+(CATALOG_SNAPSHOT_PATH). Dla odniesienia mierzy też jeden proces bez snapshotu.
+
+Uruchomienie (z katalogu głównego projektu):
+    python benchmarks/bench_workers.py [liczba_wierszy_katalogu] [czas_pomiaru_s]
+"""
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_PROCESSES = max(4, multiprocessing.cpu_count())
+WORKER_COUNTS = (1, 2, 4)
+PASSWORD = "hipokrates"
+
+
+def write_catalog(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("KOD;NAZWA BADANIA;KWOTA;KWOTA 2\n")
+        for i in range(1, rows + 1):
+            f.write(f"{i};BADANIE LABORATORYJNE NR {i} - ŻELAZO, MAGNEZ, CZYNNIK {i % 97};{i % 500},{i % 100:02d};\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, port, workers, snapshot):
+    # Wspólny SECRET_KEY - sesja z logowania musi być ważna w każdym workerze
+    env = dict(os.environ, ENVIRONMENT="development", LOG_SAMPLE_RATE="0", ADMIN_PASSWORD=PASSWORD,
+               SECRET_KEY="bench-secret-key")
+    env.pop("CATALOG_SNAPSHOT_PATH", None)
+    if snapshot:
+        env["CATALOG_SNAPSHOT_PATH"] = os.path.join(workdir, f"catalog-{port}.snapshot")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", PROJECT_DIR, "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--no-access-log", "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.post(f"{base_url}/api/login", json={"password": PASSWORD}).status_code == 200:
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    if snapshot:
+        while not os.path.exists(env["CATALOG_SNAPSHOT_PATH"]):
+            time.sleep(0.1)
+    return proc, base_url
+
+
+def client(args):
+    """Proces klienta: loguje się i wysyła zapytania wyszukiwania do upływu czasu"""
+    base_url, duration = args
+    with httpx.Client(base_url=base_url, timeout=30) as c:
+        c.post("/api/login", json={"password": PASSWORD})
+        done = 0
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            response = c.post("/api/search", json={"query": "żelazo, magnez, czynnik 1"})
+            response.raise_for_status()
+            done += 1
+    return done
+
+
+def measure(base_url, duration):
+    with multiprocessing.Pool(CLIENT_PROCESSES) as pool:
+        counts = pool.map(client, [(base_url, duration)] * CLIENT_PROCESSES)
+    return sum(counts) / duration
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"katalog: {rows} wierszy, {CLIENT_PROCESSES} procesów klienta, {duration:.0f} s na pomiar, "
+          f"{multiprocessing.cpu_count()} CPU")
+    with tempfile.TemporaryDirectory() as workdir:
+        write_catalog(os.path.join(workdir, "badania.csv"), rows)
+        configs = [(1, False)] + [(workers, True) for workers in WORKER_COUNTS]
+        for workers, snapshot in configs:
+            proc, base_url = start_server(workdir, free_port(), workers, snapshot)
+            try:
+                throughput = measure(base_url, duration)
+            finally:
+                proc.terminate()
+                proc.wait()
+            mode = "snapshot" if snapshot else "bez snapshotu"
+            print(f"  workery: {workers} ({mode}): {throughput:8.1f} żądań/s")
+
+
+if __name__ == "__main__":
+    main()
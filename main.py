@@ -2,26 +2,111 @@ from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ValidationError, validator
 import csv
 import os
 import io
+import json
+import hashlib
+import urllib.parse
+import base64
+import asyncio
 import secrets
 import time
 import logging
-from typing import List, Dict, Optional, Tuple
+import logging.handlers
+import queue
+import random
+import copy
+import sys
+import threading
+import itertools
+import math
+import mmap
+import struct
+import array
+from typing import Any, List, Dict, Optional, Tuple
 from datetime import datetime
 import pytz
-from collections import defaultdict
+from collections import defaultdict, deque, Counter
 
 # Konfiguracja logowania
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Rekordy trafiają do kolejki, a zapis na stdout wykonuje wątek w tle (QueueListener),
+# więc handlery async nie blokują się na I/O. Poza developmentem logi są w formacie JSON
+# (Cloud Logging odczytuje pola severity/message), a częste zdarzenia INFO są próbkowane.
+LOG_JSON = os.getenv("ENVIRONMENT") != "development"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))  # Część zachowanych zdarzeń z extra={"sample": True}
+
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Formatuje rekord jako jedną linię JSON z polami przekazanymi przez extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, pytz.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _LOG_RECORD_ATTRS and key != "sample":
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Przepuszcza tylko część rekordów oznaczonych extra={"sample": True}.
+    Ostrzeżenia i błędy są zawsze zachowywane."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sample", False):
+            return True
+        return random.random() < self.rate
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, który nie formatuje rekordu w wątku wywołującym -
+    zachowuje pola extra dla JsonFormatter i zamienia wyjątek na tekst"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure_logging(stream=None) -> logging.handlers.QueueListener:
+    """Podpina kolejkowy handler do root loggera i uruchamia wątek zapisujący logi"""
+    output_handler = logging.StreamHandler(stream)
+    if LOG_JSON:
+        output_handler.setFormatter(JsonFormatter())
+    else:
+        output_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -67,8 +152,129 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Profilowanie żądań (opt-in) - próbkowanie stosu wątku pętli zdarzeń podczas obsługi żądania.
+# Wyzwalacze: nagłówek X-Profile: 1 lub parametr ?profile=1 (tylko dla zalogowanych)
+# albo losowy odsetek żądań PROFILE_SAMPLE_RATE. Middleware jest dodany przed SessionMiddleware,
+# więc działa wewnątrz niego i widzi sesję.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # Sekundy między próbkami stosu
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))  # Liczba przechowywanych profili
+PROFILE_MAX_DURATION = 60  # Maksymalny czas próbkowania jednego żądania (sekundy)
+PROFILE_EXCLUDED_PATHS = ("/static", "/api/admin/profiles", "/api/platnosci/stream")
+
+recent_profiles = deque(maxlen=PROFILE_BUFFER_SIZE)
+_profile_lock = threading.Lock()  # Jednocześnie profilowane jest co najwyżej jedno żądanie
+_profile_counter = itertools.count(1)
+
+class StackSampler(threading.Thread):
+    """Wątek zbierający stosy wywołań wskazanego wątku w formacie 'folded' (flamegraph.pl, speedscope).
+    Z root_frame liczone są tylko próbki, których stos przechodzi przez tę ramkę - pętla zdarzeń
+    obsługuje równolegle inne żądania, a ich stosy trafiają wyłącznie do other_samples."""
+
+    def __init__(self, thread_id: int, interval: float, root_frame=None):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_frame = root_frame
+        self.stacks = Counter()
+        self.other_samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        deadline = time.monotonic() + PROFILE_MAX_DURATION
+        while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            in_request = self.root_frame is None
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                in_request = in_request or frame is self.root_frame
+                frame = frame.f_back
+            if not stack:
+                continue
+            if in_request:
+                self.stacks[";".join(reversed(stack))] += 1
+            else:
+                self.other_samples += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+def profile_trigger(scope) -> Optional[str]:
+    """Zwraca powód profilowania żądania lub None"""
+    path = scope.get("path", "")
+    if path.startswith(PROFILE_EXCLUDED_PATHS):
+        return None
+    trigger = None
+    if any(name == b"x-profile" and value == b"1" for name, value in scope.get("headers", [])):
+        trigger = "header"
+    elif urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile") == ["1"]:
+        trigger = "query"
+    if trigger:
+        # Ręczne wyzwalacze tylko dla zalogowanych użytkowników
+        return trigger if scope.get("session", {}).get("authenticated") else None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+class RequestProfilerMiddleware:
+    """Middleware ASGI profilujący wybrane żądania. Gdy żądanie nie jest profilowane,
+    koszt ogranicza się do sprawdzenia nagłówków i query string."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trigger = profile_trigger(scope)
+        if trigger is None or not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = next(_profile_counter)
+        status = {"code": 500}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(profile_id).encode())]
+            await send(message)
+
+        # Ramka tej korutyny jest na stosie tylko wtedy, gdy pętla wykonuje profilowane żądanie
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL, sys._getframe())
+        started = time.time()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            stacks = sampler.stop()
+            _profile_lock.release()
+            recent_profiles.append({
+                "id": profile_id,
+                "method": scope.get("method", ""),
+                "path": scope.get("path", ""),
+                "trigger": trigger,
+                "status": status["code"],
+                "started": datetime.fromtimestamp(started, pytz.utc).isoformat(),
+                "duration_ms": round((time.time() - started) * 1000, 2),
+                "samples": sum(stacks.values()),
+                "other_samples": sampler.other_samples,
+                "stacks": stacks,
+            })
+            logger.info(f"Zapisano profil {profile_id} dla {scope.get('method', '')} {scope.get('path', '')}")
+
+app.add_middleware(RequestProfilerMiddleware)
+
 # Session middleware dla autentykacji
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
+# W trybie wielu workerów każdy proces wylosowałby własny klucz i nie rozpoznawałby sesji pozostałych
+if os.getenv("CATALOG_SNAPSHOT_PATH") and not os.getenv("SECRET_KEY"):
+    raise RuntimeError("Tryb wielu workerów (CATALOG_SNAPSHOT_PATH) wymaga ustawienia SECRET_KEY")
 app.add_middleware(
     SessionMiddleware,
     secret_key=SECRET_KEY,
@@ -107,6 +313,200 @@ async def general_exception_handler(request, exc):
         content={"detail": "Wystąpił błąd serwera"}
     )
 
+# Kontrola dopuszczania żądań z priorytetami. Każda klasa ma limit równoczesnych żądań i kolejkę:
+# critical (zapis płatności, logowanie), interactive (wyszukiwanie, lista, statystyki),
+# bulk (raporty dzienne, edytor katalogu). Handlery wykonują blokujące I/O w pętli zdarzeń,
+# więc nadmiarowe żądania bulk czekają na tanim Future zamiast zajmować kolejkę pętli przed
+# zapisem płatności. Bulk jest dopuszczany tylko gdy wyższe klasy nie czekają, a przy
+# przeciążeniu odrzucany z 429 i Retry-After.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") != "0"
+ADMISSION_EXEMPT_PATHS = ("/static", "/api/admin/", "/api/platnosci/stream")
+ADMISSION_CRITICAL_PATHS = {"/api/platnosci/save", "/api/platnosci/save-batch", "/api/login"}
+ADMISSION_BULK_PATHS = {"/api/platnosci/by-date", "/api/badania/edit"}
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+class AdmissionClass:
+    """Limit, kolejka i statystyki jednej klasy priorytetu"""
+
+    def __init__(self, name: str, priority: int, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.priority = priority  # Mniejsza wartość = wyższy priorytet
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=1000)  # Ostatnie czasy oczekiwania (sekundy)
+        self.service_time = 0.0  # Średnia krocząca czasu obsługi (sekundy)
+
+    def stats(self) -> Dict:
+        waits = sorted(self.waits)
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 2) if waits else 0.0
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_p50_ms": percentile(0.5),
+            "wait_p99_ms": percentile(0.99),
+            "service_ms": round(self.service_time * 1000, 2),
+        }
+
+class AdmissionController:
+    def __init__(self, classes: List[AdmissionClass]):
+        self.classes = sorted(classes, key=lambda c: c.priority)
+        self.by_name = {c.name: c for c in self.classes}
+
+    def classify(self, path: str) -> Optional[AdmissionClass]:
+        if path.startswith(ADMISSION_EXEMPT_PATHS):
+            return None
+        if path in ADMISSION_CRITICAL_PATHS:
+            return self.by_name["critical"]
+        if path in ADMISSION_BULK_PATHS:
+            return self.by_name["bulk"]
+        return self.by_name["interactive"]
+
+    def _higher_waiting(self, admission_class: AdmissionClass) -> bool:
+        return any(c.waiters for c in self.classes if c.priority < admission_class.priority)
+
+    def _admit(self, admission_class: AdmissionClass, wait: float):
+        admission_class.active += 1
+        admission_class.admitted += 1
+        admission_class.waits.append(wait)
+
+    def retry_after(self, admission_class: AdmissionClass) -> int:
+        estimate = admission_class.service_time * (len(admission_class.waiters) + 1) / admission_class.limit
+        return max(1, min(60, math.ceil(estimate)))
+
+    async def acquire(self, admission_class: AdmissionClass):
+        """Czeka na wolne miejsce w klasie; rzuca AdmissionRejected przy pełnej kolejce lub po max_wait"""
+        if (admission_class.active < admission_class.limit and not admission_class.waiters
+                and not self._higher_waiting(admission_class)):
+            self._admit(admission_class, 0.0)
+            return
+        if len(admission_class.waiters) >= admission_class.max_queue:
+            admission_class.rejected += 1
+            raise AdmissionRejected(self.retry_after(admission_class))
+        start = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        admission_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, admission_class.max_wait)
+        except asyncio.TimeoutError:
+            # Od Pythona 3.12 wait_for może zgłosić timeout już po przydzieleniu miejsca przez _dispatch
+            if waiter.done() and not waiter.cancelled():
+                self.release(admission_class, None)
+            admission_class.rejected += 1
+            raise AdmissionRejected(self.retry_after(admission_class))
+        except asyncio.CancelledError:
+            # Klient rozłączył się podczas oczekiwania - oddaj miejsce, jeśli zostało przydzielone
+            if waiter.done() and not waiter.cancelled():
+                self.release(admission_class, None)
+            raise
+        finally:
+            if waiter in admission_class.waiters:
+                admission_class.waiters.remove(waiter)
+                # Niższe klasy mogły czekać tylko z powodu tego żądania
+                self._dispatch()
+        admission_class.waits.append(time.perf_counter() - start)
+
+    def release(self, admission_class: AdmissionClass, service_time: Optional[float]):
+        admission_class.active -= 1
+        if service_time is not None:
+            admission_class.service_time = 0.9 * admission_class.service_time + 0.1 * service_time
+        self._dispatch()
+
+    def _dispatch(self):
+        """Przydziela zwolnione miejsca oczekującym, od najwyższego priorytetu"""
+        for admission_class in self.classes:
+            while admission_class.waiters and admission_class.active < admission_class.limit:
+                if self._higher_waiting(admission_class):
+                    return
+                waiter = admission_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                admission_class.active += 1
+                admission_class.admitted += 1
+                waiter.set_result(None)
+
+admission_controller = AdmissionController([
+    AdmissionClass("critical", 0, int(os.getenv("ADMISSION_CRITICAL_LIMIT", "8")), 100, 30.0),
+    AdmissionClass("interactive", 1, int(os.getenv("ADMISSION_INTERACTIVE_LIMIT", "4")), 50, 10.0),
+    AdmissionClass("bulk", 2, int(os.getenv("ADMISSION_BULK_LIMIT", "1")), int(os.getenv("ADMISSION_BULK_QUEUE", "10")), 5.0),
+])
+
+class AdmissionControlMiddleware:
+    """Middleware ASGI dopuszczający żądania przez AdmissionController"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        admission_class = admission_controller.classify(scope.get("path", "")) if scope["type"] == "http" else None
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await admission_controller.acquire(admission_class)
+        except AdmissionRejected as e:
+            logger.warning(f"Odrzucono żądanie {scope.get('path', '')} (klasa {admission_class.name}) - przeciążenie")
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Serwer jest przeciążony. Spróbuj ponownie później."},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_controller.release(admission_class, time.perf_counter() - start)
+
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionControlMiddleware)
+
+# Middleware logujący każde żądanie jako zdarzenie strukturalne (próbkowane, błędy zawsze)
+@app.middleware("http")
+async def log_requests(request: Request, call_next):
+    start = time.perf_counter()
+    client_ip = request.client.host if request.client else "unknown"
+    try:
+        response = await call_next(request)
+    except Exception:
+        logger.error("Żądanie zakończone błędem", extra={
+            "route": request.url.path,
+            "method": request.method,
+            "status": 500,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            "client_ip": client_ip,
+        })
+        raise
+    route = request.scope.get("route")
+    status = response.status_code
+    logger.log(
+        logging.ERROR if status >= 500 else logging.INFO,
+        "%s %s %s", request.method, request.url.path, status,
+        extra={
+            "route": getattr(route, "path", request.url.path),
+            "method": request.method,
+            "status": status,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            "client_ip": client_ip,
+            "sample": status < 400,
+        }
+    )
+    return response
+
 # Middleware do dodawania nagłówków bezpieczeństwa
 @app.middleware("http")
 async def add_security_headers(request: Request, call_next):
@@ -161,6 +561,136 @@ def use_cloud_storage_for_csv() -> bool:
     Google Cloud Storage jest używany na produkcji (np. Cloud Run), gdzie ENVIRONMENT nie jest ustawione na development."""
     return os.getenv("ENVIRONMENT") != "development"
 
+# Lokalna pamięć podręczna obiektów z bucketu na dysku, kluczowana numerem generation.
+# Przed odczytem wystarcza wywołanie metadanych (blob.reload): ta sama generacja jest czytana
+# z dysku, a gdy obiekt tylko urósł (dopisane płatności) pobierany jest wyłącznie nowy koniec
+# pliku, weryfikowany sumą MD5 całego obiektu. Katalog przetrwa restart procesu na tym samym węźle.
+# Domyślnie wyłączona: na Cloud Run katalog tymczasowy to tmpfs, więc pamięć podręczna zajmowałaby
+# pamięć instancji - należy wskazać trwały katalog (np. zamontowany wolumen).
+BUCKET_CACHE_DIR = os.getenv("BUCKET_CACHE_DIR")
+BUCKET_CACHE_MAX_BYTES = int(os.getenv("BUCKET_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+BUCKET_CACHE_TMP_MAX_AGE = 3600  # Po tylu sekundach plik .tmp uznawany jest za pozostałość po przerwanym zapisie
+
+class BucketCache:
+    """Pamięć podręczna obiektów GCS na dysku z limitem rozmiaru i usuwaniem najdawniej używanych (LRU).
+    Plik obiektu: <nazwa>.<generation>; czas modyfikacji pliku oznacza ostatnie użycie.
+    Doczytywanie samego końca pliku dotyczy tylko obiektów z append_only (pozostałe mogą być
+    edytowane w środku, a zgodność sumy MD5 sprawdzana jest dopiero po pobraniu końca)."""
+
+    def __init__(self, directory: Optional[str], max_bytes: int, append_only: Tuple[str, ...] = ()):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.append_only = set(append_only)
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Pamięć podręczna bucketu wyłączona - nie można utworzyć {directory}: {e}")
+                self.directory = None
+
+    def _prefix(self, name: str) -> str:
+        return urllib.parse.quote(name, safe="") + "."
+
+    def _path(self, name: str, generation: int) -> str:
+        return os.path.join(self.directory, f"{self._prefix(name)}{generation}")
+
+    def _cached_generations(self, name: str) -> List[Tuple[int, str]]:
+        prefix = self._prefix(name)
+        found = []
+        for entry in os.listdir(self.directory):
+            suffix = entry[len(prefix):]
+            if entry.startswith(prefix) and suffix.isdigit():
+                found.append((int(suffix), os.path.join(self.directory, entry)))
+        return sorted(found)
+
+    def read(self, blob) -> bytes:
+        """Zwraca zawartość obiektu. Korzysta z dysku tylko po wcześniejszym blob.reload()
+        (generation, size, md5_hash); bez metadanych pobiera aktualną wersję obiektu."""
+        generation = blob.generation
+        if not self.directory or generation is None:
+            return blob.download_as_bytes(timeout=STORAGE_TIMEOUT)
+        try:
+            path = self._path(blob.name, generation)
+            if os.path.exists(path):
+                os.utime(path)
+                with open(path, "rb") as f:
+                    return f.read()
+            cached = self._cached_generations(blob.name)
+        except OSError as e:
+            logger.warning(f"Błąd odczytu pamięci podręcznej bucketu: {e}")
+            return blob.download_as_bytes(timeout=STORAGE_TIMEOUT)
+
+        data = None
+        if cached and blob.name in self.append_only and blob.md5_hash and blob.size is not None:
+            data = self._read_appended(blob, cached[-1][1])
+        if data is None:
+            data = blob.download_as_bytes(timeout=STORAGE_TIMEOUT)
+        self.store(blob.name, generation, data)
+        return data
+
+    def _read_appended(self, blob, cached_path: str) -> Optional[bytes]:
+        """Składa obiekt z poprzedniej generacji i dopisanego końca. None, gdy obiekt zmienił się inaczej."""
+        try:
+            with open(cached_path, "rb") as f:
+                previous = f.read()
+        except OSError:
+            return None
+        if blob.size < len(previous):
+            return None
+        if blob.size > len(previous):
+            tail = blob.download_as_bytes(start=len(previous), timeout=STORAGE_TIMEOUT)
+            data = previous + tail
+        else:
+            data = previous
+        if base64.b64encode(hashlib.md5(data).digest()).decode() != blob.md5_hash:
+            return None
+        logger.info(f"Pobrano tylko dopisane {blob.size - len(previous)} B z {blob.name} (z {blob.size} B)")
+        return data
+
+    def store(self, name: str, generation: Optional[int], data: bytes):
+        """Zapisuje generację obiektu (np. po własnym uploadzie) i usuwa starsze generacje"""
+        if not self.directory or generation is None:
+            return
+        try:
+            path = self._path(name, generation)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            for cached_generation, cached_path in self._cached_generations(name):
+                if cached_generation != generation:
+                    os.remove(cached_path)
+            self._evict()
+        except OSError as e:
+            logger.warning(f"Błąd zapisu pamięci podręcznej bucketu: {e}")
+
+    def _evict(self):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.endswith(".tmp"):
+                # Świeże pliki .tmp mogą być właśnie zapisywane przez inny proces
+                if now - stat.st_mtime > BUCKET_CACHE_TMP_MAX_AGE:
+                    os.remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+# Do platnosci.csv wiersze są tylko dopisywane; badania.csv bywa edytowany w dowolnym miejscu
+bucket_cache = BucketCache(BUCKET_CACHE_DIR, BUCKET_CACHE_MAX_BYTES, append_only=(PLATNOSCI_FILE_NAME,))
+
+def download_blob_text(blob) -> str:
+    """Pobiera obiekt przez pamięć podręczną na dysku (gdy blob ma aktualne metadane)"""
+    return bucket_cache.read(blob).decode("utf-8")
+
 def parse_price(price_str: str) -> float:
     """Konwertuje cenę z formatu '2,00' na float"""
     if not price_str or price_str.strip() == "":
@@ -194,7 +724,10 @@ def load_badania() -> List[Dict]:
             try:
                 bucket = storage_client.bucket(BUCKET_NAME)
                 blob = bucket.blob(CSV_FILE_NAME)
-                csv_content = blob.download_as_text(encoding='utf-8', timeout=STORAGE_TIMEOUT)
+                if bucket_cache.directory:
+                    # Metadane (generation) wystarczą, aby odczytać plik z pamięci podręcznej
+                    blob.reload(timeout=STORAGE_TIMEOUT)
+                csv_content = download_blob_text(blob)
             finally:
                 if hasattr(signal, 'SIGALRM'):
                     signal.alarm(0)  # Wyłącz alarm
@@ -216,7 +749,12 @@ def load_badania() -> List[Dict]:
     # Parsuj CSV
     csv_io = io.StringIO(csv_content)
     reader = csv.DictReader(csv_io, delimiter=';')
-    for row in reader:
+    return parse_badania(reader)
+
+def parse_badania(rows) -> List[Dict]:
+    """Konwertuje wiersze badania.csv na badania dla wyszukiwarki (pomija wiersze bez nazwy)"""
+    badania = []
+    for row in rows:
         kod = row.get('KOD', '').strip()
         nazwa = row.get('NAZWA BADANIA', '').strip()
         kwota_str = row.get('KWOTA', '').strip()
@@ -316,7 +854,11 @@ async def require_auth(request: Request):
 @app.get("/api/badania")
 async def get_badania(auth: bool = Depends(require_auth)):
     """Zwraca wszystkie badania posortowane alfabetycznie - wymaga autentykacji"""
-    logger.info(f"Pobieranie listy badań")
+    logger.info("Pobieranie listy badań", extra={"sample": True})
+    shared = shared_catalog.current()
+    if shared is not None:
+        # Gotowy JSON ze współdzielonego snapshotu - bez pobierania, parsowania i serializacji
+        return Response(content=shared.section("badania"), media_type="application/json")
     badania = load_badania()
     # Sortuj alfabetycznie po nazwie
     badania_sorted = sorted(badania, key=lambda x: x['nazwa'].lower())
@@ -335,8 +877,9 @@ async def search_badania(request: Request, auth: bool = Depends(require_auth)):
     if not query:
         return {"badania": []}
     
-    logger.info(f"Wyszukiwanie: {query[:50]}...")
-    wszystkie_badania = load_badania()
+    logger.info("Wyszukiwanie: %s...", query[:50], extra={"sample": True})
+    shared = shared_catalog.current()
+    wszystkie_badania = shared.badania if shared is not None else load_badania()
     # Wyszukiwanie case-insensitive
     results = [
         badanie for badanie in wszystkie_badania
@@ -360,8 +903,10 @@ def load_full_csv() -> Tuple[List[Dict], Optional[int]]:
             def timeout_handler(signum, frame):
                 raise TimeoutError("Timeout podczas pobierania z Cloud Storage")
             
-            # Ustaw timeout (tylko na Unix)
-            if hasattr(signal, 'SIGALRM'):
+            # Ustaw timeout (tylko na Unix i tylko w głównym wątku - load_full_csv
+            # jest wywoływane także z wątku odświeżającego snapshot katalogu)
+            use_alarm = hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread()
+            if use_alarm:
                 signal.signal(signal.SIGALRM, timeout_handler)
                 signal.alarm(STORAGE_TIMEOUT)
             
@@ -371,16 +916,18 @@ def load_full_csv() -> Tuple[List[Dict], Optional[int]]:
                 # Pobierz generation number dla optimistic locking
                 blob.reload(timeout=STORAGE_TIMEOUT)
                 generation = blob.generation
-                csv_content = blob.download_as_text(encoding='utf-8', timeout=STORAGE_TIMEOUT)
+                csv_content = download_blob_text(blob)
             finally:
-                if hasattr(signal, 'SIGALRM'):
+                if use_alarm:
                     signal.alarm(0)  # Wyłącz alarm
         except TimeoutError:
             logger.error("Timeout podczas pobierania z Cloud Storage")
             csv_content = None
+            generation = None  # Fallback lokalny nie odpowiada generacji z GCS
         except Exception as e:
             logger.error(f"Błąd podczas pobierania z Cloud Storage: {e}")
             csv_content = None
+            generation = None
     
     # Jeśli nie udało się pobrać z Cloud Storage, spróbuj lokalnie
     if csv_content is None:
@@ -395,21 +942,363 @@ def load_full_csv() -> Tuple[List[Dict], Optional[int]]:
     reader = csv.DictReader(csv_io, delimiter=';')
     return list(reader), generation
 
-@app.get("/api/badania/edit")
-async def get_badania_for_edit(auth: bool = Depends(require_auth)):
-    """Zwraca wszystkie badania do edycji - wymaga autentykacji"""
-    logger.info("Pobieranie badań do edycji")
-    badania, _ = load_full_csv()  # Ignoruj generation number dla odczytu
-    # Konwertuj nazwy kolumn dla frontendu
-    result = []
-    for row in badania:
-        result.append({
+# Kolejność sortowania polskich liter: każda litera z ogonkiem zaraz po swojej literze bazowej
+POLISH_COLLATION = {'ą': 'a1', 'ć': 'c1', 'ę': 'e1', 'ł': 'l1', 'ń': 'n1', 'ó': 'o1', 'ś': 's1', 'ź': 'z1', 'ż': 'z2'}
+
+def polish_sort_key(text: str) -> str:
+    """Klucz sortowania tekstu wg polskiego alfabetu, bez rozróżniania wielkości liter"""
+    return "".join(POLISH_COLLATION.get(c, c + '0') for c in text.casefold())
+
+class CatalogSnapshot:
+    """Wiersze katalogu w formacie edytora z indeksami posortowanymi po KOD, NAZWA i KWOTA.
+    Budowany raz dla każdej wersji pliku badania.csv."""
+
+    SORT_KEYS = ("kod", "nazwa", "kwota")
+
+    def __init__(self, rows: List[Dict], version):
+        self.version = version
+        self.rows = [{
             'KOD': row.get('KOD', ''),
             'NAZWA_BADANIA': row.get('NAZWA BADANIA', ''),
             'KWOTA': row.get('KWOTA', ''),
             'KWOTA_2': row.get('KWOTA 2', '')
-        })
-    return {"badania": result}
+        } for row in rows]
+        self.haystacks = self._build_haystacks(self.rows)
+        # Dla każdego klucza: (pozycje rosnąco, pozycje malejąco, pozycje bez wartości)
+        self.indexes = {
+            "kod": self._build_index(lambda row: int(row['KOD']) if row['KOD'].strip().isdigit() else None),
+            "nazwa": self._build_index(lambda row: polish_sort_key(row['NAZWA_BADANIA']) if row['NAZWA_BADANIA'].strip() else None),
+            "kwota": self._build_index(lambda row: parse_price(row['KWOTA']) if row['KWOTA'].strip() else None),
+        }
+
+    @classmethod
+    def from_parts(cls, rows: List[Dict], version, indexes: Dict) -> "CatalogSnapshot":
+        """Tworzy katalog z gotowych wierszy i indeksów (np. ze współdzielonego snapshotu)"""
+        catalog = cls.__new__(cls)
+        catalog.version = version
+        catalog.rows = rows
+        catalog.haystacks = cls._build_haystacks(rows)
+        catalog.indexes = indexes
+        return catalog
+
+    @staticmethod
+    def _build_haystacks(rows: List[Dict]) -> List[str]:
+        # Tekst do filtrowania (jak w edytorze: kod, nazwa, kwota, kwota 2)
+        return [
+            "\x00".join((row['KOD'], row['NAZWA_BADANIA'], row['KWOTA'], row['KWOTA_2'])).casefold()
+            for row in rows
+        ]
+
+    def _build_index(self, key_func) -> Tuple[List[int], List[int], List[int]]:
+        keyed = []
+        empty = []
+        for position, row in enumerate(self.rows):
+            key = key_func(row)
+            if key is None:
+                empty.append(position)
+            else:
+                keyed.append((key, position))
+        keyed.sort()
+        ascending = [position for _, position in keyed]
+        # Sortowanie stabilne - przy równych wartościach zachowana kolejność z pliku
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        return ascending, [position for _, position in keyed], empty
+
+    def query(self, sort: Optional[str], descending: bool, q: str) -> List[int]:
+        """Zwraca pozycje wierszy pasujących do filtra w żądanej kolejności (puste wartości na końcu)"""
+        if sort:
+            ascending, descending_order, empty = self.indexes[sort]
+            order = itertools.chain(descending_order if descending else ascending, empty)
+        else:
+            order = range(len(self.rows))
+        q = q.strip().casefold()
+        if not q:
+            return list(order)
+        return [position for position in order if q in self.haystacks[position]]
+
+catalog_snapshot: Optional[CatalogSnapshot] = None
+
+def get_catalog_version():
+    """Zwraca wersję pliku badania.csv (generation w GCS lub mtime/rozmiar lokalnie) bez pobierania treści.
+    None oznacza, że wersji nie da się ustalić."""
+    storage_client = get_storage_client() if use_cloud_storage_for_csv() else None
+    if storage_client:
+        try:
+            blob = storage_client.bucket(BUCKET_NAME).blob(CSV_FILE_NAME)
+            blob.reload(timeout=STORAGE_TIMEOUT)
+            return blob.generation
+        except Exception as e:
+            logger.error(f"Błąd podczas sprawdzania wersji badania.csv w Cloud Storage: {e}")
+            return None
+    try:
+        stat = os.stat(CSV_FILE)
+        return f"local:{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        return None
+
+def cloud_read_failed(generation: Optional[int]) -> bool:
+    """W trybie Cloud Storage brak generation oznacza, że pobranie z GCS się nie powiodło,
+    a load_full_csv/load_platnosci zwróciło lokalny fallback (na Cloud Run zwykle pusty)"""
+    return generation is None and use_cloud_storage_for_csv() and get_storage_client() is not None
+
+def get_catalog() -> CatalogSnapshot:
+    """Zwraca katalog z pamięci podręcznej, pobierając plik tylko gdy zmieniła się jego wersja"""
+    global catalog_snapshot
+    shared = shared_catalog.current()
+    if shared is not None:
+        return shared.catalog
+    version = get_catalog_version()
+    if catalog_snapshot is not None and version is not None and catalog_snapshot.version == version:
+        return catalog_snapshot
+    rows, generation = load_full_csv()
+    if cloud_read_failed(generation):
+        # Wynik z lokalnego fallbacku nie może trafić do pamięci podręcznej pod wersją z GCS
+        logger.warning("Katalog wczytany bez Cloud Storage - pomijam zapis w pamięci podręcznej")
+        return CatalogSnapshot(rows, None)
+    catalog_snapshot = CatalogSnapshot(rows, generation if generation is not None else version)
+    return catalog_snapshot
+
+def invalidate_catalog():
+    global catalog_snapshot
+    catalog_snapshot = None
+    if CATALOG_SNAPSHOT_PATH:
+        # Zapisz nowy snapshot od razu, aby inne workery nie czekały na odświeżenie
+        try:
+            publish_catalog_snapshot()
+        except Exception as e:
+            logger.error(f"Błąd podczas zapisu snapshotu katalogu: {e}")
+
+# Współdzielony snapshot katalogu dla trybu wielu workerów (uvicorn --workers N).
+# Jeden worker (wybrany blokadą pliku) odświeża plik snapshotu, gdy zmieni się wersja badania.csv.
+# Wszystkie workery mapują plik tylko do odczytu (mmap) i przełączają się na nowy plik po jego
+# atomowej podmianie (os.replace), więc nie pobierają katalogu z GCS osobno.
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH")  # Brak = tryb jednego procesu
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))  # Sekundy między sprawdzeniami wersji
+SNAPSHOT_MAGIC = b"BADCAT01"
+SNAPSHOT_HEADER = struct.Struct("<8sQI")  # magic, generation, liczba sekcji
+SNAPSHOT_SECTION = struct.Struct("<24sQQ")  # nazwa, offset, długość
+
+def _json_bytes(data) -> bytes:
+    # Ten sam format co JSONResponse FastAPI
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def build_catalog_sections(rows: List[Dict], version) -> Dict[str, bytes]:
+    """Przygotowuje sekcje snapshotu: gotowe odpowiedzi JSON, wiersze edytora i indeksy sortowania"""
+    badania = sorted(parse_badania(rows), key=lambda x: x['nazwa'].lower())
+    catalog = CatalogSnapshot(rows, version)
+    sections = {
+        "meta": _json_bytes({"version": version}),
+        "badania": _json_bytes({"badania": badania}),
+        "edit": _json_bytes({"badania": catalog.rows}),
+    }
+    for key, (ascending, descending, empty) in catalog.indexes.items():
+        sections[f"{key}.asc"] = array.array("I", ascending).tobytes()
+        sections[f"{key}.desc"] = array.array("I", descending).tobytes()
+        sections[f"{key}.empty"] = array.array("I", empty).tobytes()
+    return sections
+
+def read_snapshot_generation(path: str) -> int:
+    try:
+        with open(path, "rb") as f:
+            magic, generation, _ = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+        return generation if magic == SNAPSHOT_MAGIC else 0
+    except (OSError, struct.error):
+        return 0
+
+def write_catalog_snapshot(path: str, sections: Dict[str, bytes]) -> int:
+    """Zapisuje snapshot do pliku tymczasowego i atomowo podmienia plik docelowy.
+    Zwraca nowy numer generacji."""
+    import fcntl
+    with open(path + ".write.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        generation = read_snapshot_generation(path) + 1
+        names = list(sections)
+        offset = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * len(names)
+        table = []
+        for name in names:
+            table.append(SNAPSHOT_SECTION.pack(name.encode(), offset, len(sections[name])))
+            offset += len(sections[name])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation, len(names)))
+            f.writelines(table)
+            for name in names:
+                f.write(sections[name])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    return generation
+
+def publish_catalog_snapshot() -> Optional[int]:
+    """Pobiera katalog i zapisuje nowy snapshot. Zwraca numer generacji snapshotu lub None,
+    gdy pobranie z Cloud Storage się nie powiodło (wtedy snapshot nie jest zmieniany)."""
+    rows, generation = load_full_csv()
+    if cloud_read_failed(generation):
+        # Nie publikuj fallbacku pod wersją z GCS - odświeżacz spróbuje ponownie w następnym cyklu
+        logger.warning("Katalog wczytany bez Cloud Storage - pomijam publikację snapshotu")
+        return None
+    version = generation if generation is not None else get_catalog_version()
+    snapshot_generation = write_catalog_snapshot(CATALOG_SNAPSHOT_PATH, build_catalog_sections(rows, version))
+    logger.info(f"Zapisano snapshot katalogu (generacja {snapshot_generation}, {len(rows)} wierszy)")
+    return snapshot_generation
+
+class MappedCatalog:
+    """Jedna generacja snapshotu zmapowana tylko do odczytu. Obiekty pochodne (lista badań,
+    katalog edytora) są tworzone leniwie, raz na generację w danym workerze."""
+
+    def __init__(self, f, stat_key):
+        self.stat_key = stat_key
+        self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, count = SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Nieprawidłowy plik snapshotu katalogu")
+        view = memoryview(self._mmap)
+        self._sections = {}
+        for i in range(count):
+            name, offset, length = SNAPSHOT_SECTION.unpack_from(self._mmap, SNAPSHOT_HEADER.size + i * SNAPSHOT_SECTION.size)
+            self._sections[name.rstrip(b"\0").decode()] = view[offset:offset + length]
+        self.version = json.loads(bytes(self._sections["meta"]))["version"]
+        self._badania = None
+        self._catalog = None
+
+    def section(self, name: str) -> bytes:
+        return bytes(self._sections[name])
+
+    @property
+    def badania(self) -> List[Dict]:
+        if self._badania is None:
+            self._badania = json.loads(bytes(self._sections["badania"]))["badania"]
+        return self._badania
+
+    @property
+    def catalog(self) -> CatalogSnapshot:
+        if self._catalog is None:
+            rows = json.loads(bytes(self._sections["edit"]))["badania"]
+            # Indeksy sortowania czytane bezpośrednio z mapowanej pamięci
+            indexes = {
+                key: tuple(self._sections[f"{key}.{part}"].cast("I") for part in ("asc", "desc", "empty"))
+                for key in CatalogSnapshot.SORT_KEYS
+            }
+            self._catalog = CatalogSnapshot.from_parts(rows, self.version, indexes)
+        return self._catalog
+
+class SharedCatalog:
+    """Dostęp workera do aktualnej generacji snapshotu katalogu"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._mapped: Optional[MappedCatalog] = None
+
+    def current(self) -> Optional[MappedCatalog]:
+        """Zwraca aktualną generację lub None (tryb wyłączony albo snapshot jeszcze nie istnieje)"""
+        if not self.path:
+            return None
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        mapped = self._mapped
+        if mapped is None or mapped.stat_key != stat_key:
+            try:
+                with open(self.path, "rb") as f:
+                    mapped = MappedCatalog(f, stat_key)
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Błąd podczas mapowania snapshotu katalogu: {e}")
+                return self._mapped
+            # Podmiana referencji - trwające żądania korzystają dalej ze starej generacji
+            self._mapped = mapped
+        return mapped
+
+shared_catalog = SharedCatalog(CATALOG_SNAPSHOT_PATH)
+
+def catalog_refresher():
+    """Wątek odświeżający snapshot. Działa tylko w workerze, który zdobył blokadę lidera;
+    pozostałe czekają na blokadzie i przejmują rolę, gdy lider zakończy działanie."""
+    import fcntl
+    lock_file = open(CATALOG_SNAPSHOT_PATH + ".leader.lock", "w")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    logger.info(f"Proces {os.getpid()} odświeża snapshot katalogu")
+    while True:
+        try:
+            mapped = shared_catalog.current()
+            if mapped is None or mapped.version != get_catalog_version():
+                publish_catalog_snapshot()
+        except Exception as e:
+            logger.error(f"Błąd podczas odświeżania snapshotu katalogu: {e}")
+        time.sleep(CATALOG_REFRESH_INTERVAL)
+
+MAX_EDIT_PAGE_SIZE = 1000  # Maksymalna liczba wierszy na stronę w /api/badania/edit
+
+def edit_query_hash(sort: Optional[str], q: str) -> str:
+    """Skrót parametrów sortowania i filtra - kursor jest ważny tylko dla tego samego zapytania"""
+    return hashlib.sha256(json.dumps([sort, q]).encode()).hexdigest()[:16]
+
+def encode_edit_cursor(offset: int, version, query_hash: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"o": offset, "v": version, "h": query_hash}).encode()).decode()
+
+def decode_edit_cursor(cursor: str) -> Tuple[int, object, Optional[str]]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(data["o"]), data.get("v"), data.get("h")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy kursor")
+
+@app.get("/api/badania/edit")
+async def get_badania_for_edit(
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    q: str = "",
+    auth: bool = Depends(require_auth)
+):
+    """Zwraca badania do edycji - wymaga autentykacji
+    Bez parametru limit zwraca wszystkie wiersze. Z limit zwraca stronę wyników:
+    offset albo cursor (z next_cursor poprzedniej strony, z tymi samymi sort i q), sort = kod|nazwa|kwota (z '-' malejąco),
+    q = filtr po kodzie, nazwie i kwotach. Każdy wiersz strony ma INDEX - pozycję w pliku."""
+    logger.info("Pobieranie badań do edycji", extra={"sample": True})
+    full_list = limit is None and cursor is None and sort is None and not q and not offset
+    shared = shared_catalog.current()
+    if full_list and shared is not None:
+        return Response(content=shared.section("edit"), media_type="application/json")
+    catalog = get_catalog()
+    if full_list:
+        return {"badania": catalog.rows}
+    
+    # Walidacja parametrów
+    if len(q) > 200:
+        raise HTTPException(status_code=400, detail="Zapytanie zbyt długie")
+    descending = bool(sort) and sort.startswith("-")
+    sort_key = sort.lstrip("-") if sort else None
+    if sort_key is not None and sort_key not in CatalogSnapshot.SORT_KEYS:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy klucz sortowania")
+    limit = MAX_EDIT_PAGE_SIZE if limit is None else limit
+    if limit < 1 or limit > MAX_EDIT_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit musi być w przedziale od 1 do {MAX_EDIT_PAGE_SIZE}")
+    query_hash = edit_query_hash(sort, q)
+    if cursor is not None:
+        if offset is not None:
+            raise HTTPException(status_code=400, detail="Podaj offset albo cursor, nie oba")
+        offset, cursor_version, cursor_hash = decode_edit_cursor(cursor)
+        if cursor_hash != query_hash:
+            raise HTTPException(status_code=400, detail="Kursor dotyczy innego sortowania lub filtra")
+        if cursor_version != catalog.version:
+            raise HTTPException(status_code=409, detail="Dane zostały zmienione. Odśwież listę.")
+    offset = offset or 0
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy offset")
+    
+    positions = catalog.query(sort_key, descending, q)
+    page = positions[offset:offset + limit]
+    next_offset = offset + len(page)
+    return {
+        "badania": [dict(catalog.rows[position], INDEX=position) for position in page],
+        "total": len(positions),
+        "offset": offset,
+        "next_cursor": encode_edit_cursor(next_offset, catalog.version, query_hash) if next_offset < len(positions) else None,
+        "version": catalog.version
+    }
 
 class BadanieRow(BaseModel):
     KOD: str
@@ -527,6 +1416,8 @@ async def save_badania(data: BadaniaUpdate, request: Request, auth: bool = Depen
                         # Pierwszy zapis lub lokalny fallback
                         blob.upload_from_string(csv_content, content_type='text/csv')
                     
+                    bucket_cache.store(blob.name, blob.generation, csv_content.encode('utf-8'))
+                    invalidate_catalog()
                     return {"success": True, "message": "Dane zostały zapisane do Cloud Storage"}
                 except Exception as e:
                     error_str = str(e)
@@ -558,6 +1449,7 @@ async def save_badania(data: BadaniaUpdate, request: Request, auth: bool = Depen
             try:
                 with open(CSV_FILE, 'w', encoding='utf-8') as f:
                     f.write(csv_content)
+                invalidate_catalog()
                 return {"success": True, "message": "Dane zostały zapisane lokalnie"}
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Błąd podczas zapisu do pliku lokalnego: {str(e)}")
@@ -581,6 +1473,104 @@ class PlatnoscCreate(BaseModel):
     kwota: float
     uwagi: str = ""
 
+class PlatnosciBatch(BaseModel):
+    # Pozycje walidowane osobno - błędna płatność nie odrzuca całego batcha
+    platnosci: List[Any]
+
+MAX_PLATNOSCI_BATCH = 1000  # Maksymalna liczba płatności w jednym żądaniu batch
+
+def validate_platnosc(data: PlatnoscCreate) -> Optional[str]:
+    """Zwraca komunikat błędu walidacji płatności lub None"""
+    if data.kwota < 0 or data.kwota > 1000000:
+        return "Nieprawidłowa kwota"
+    if len(data.uwagi) > 1000:
+        return "Uwagi zbyt długie (maksymalnie 1000 znaków)"
+    return None
+
+def platnosc_to_row(data: PlatnoscCreate) -> Dict:
+    """Konwertuje płatność na wiersz pliku platnosci.csv"""
+    return {
+        'UID': data.uid,
+        'DATA': data.data,
+        'BADANIA': data.badania,
+        'KWOTA': str(data.kwota).replace('.', ','),
+        'UWAGI': data.uwagi
+    }
+
+def serialize_platnosci(platnosci: List[Dict]) -> str:
+    """Zwraca zawartość pliku platnosci.csv dla podanych wierszy"""
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    
+    # Nagłówek
+    writer.writerow(['UID', 'DATA', 'BADANIA', 'KWOTA', 'UWAGI'])
+    
+    # Wiersze danych
+    for row in platnosci:
+        writer.writerow([
+            row.get('UID', ''),
+            row.get('DATA', ''),
+            row.get('BADANIA', ''),
+            row.get('KWOTA', ''),
+            row.get('UWAGI', '')
+        ])
+    
+    return output.getvalue()
+
+class PlatnosciUidIndex:
+    """Indeks płatności w pamięci: UID -> wiersz z platnosci.csv.
+    Pozwala na idempotentny zapis (ponowienia z tym samym UID) i wyszukiwanie bez skanowania pliku.
+    Zapamiętuje wersję pliku, z której zbudowano indeks, aby nie wczytywać go ponownie bez zmian."""
+
+    def __init__(self):
+        self._rows: Dict[str, Dict] = {}
+        self.version: Optional[str] = None
+
+    def rebuild(self, platnosci: List[Dict], version: Optional[str] = None):
+        self._rows = {}
+        self.version = version
+        for row in platnosci:
+            uid = (row.get('UID') or '').strip()
+            if uid:
+                self._rows[uid] = row
+
+    def add(self, row: Dict):
+        uid = (row.get('UID') or '').strip()
+        if uid:
+            self._rows[uid] = row
+
+    def get(self, uid: str) -> Optional[Dict]:
+        return self._rows.get(uid.strip())
+
+    def __contains__(self, uid: str) -> bool:
+        return uid.strip() in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+platnosci_uid_index = PlatnosciUidIndex()
+
+def local_platnosci_version() -> Optional[str]:
+    try:
+        stat = os.stat(PLATNOSCI_FILE)
+    except OSError:
+        return None
+    return f"local:{stat.st_mtime_ns}:{stat.st_size}"
+
+def current_platnosci_version() -> Optional[str]:
+    """Zwraca wersję platnosci.csv jednym zapytaniem o metadane (lub stat pliku lokalnego)"""
+    storage_client = get_storage_client() if use_cloud_storage_for_csv() else None
+    if storage_client:
+        try:
+            blob = storage_client.bucket(BUCKET_NAME).blob(PLATNOSCI_FILE_NAME)
+            blob.reload(timeout=STORAGE_TIMEOUT)
+            return f"gcs:{blob.generation}"
+        except Exception as e:
+            # Bez wersji z GCS nie odświeżaj indeksu - lokalna kopia zastąpiłaby prawdziwe płatności
+            logger.error(f"Błąd podczas pobierania metadanych platnosci.csv z Cloud Storage: {e}")
+            return None
+    return local_platnosci_version()
+
 def load_platnosci() -> Tuple[List[Dict], Optional[int]]:
     """Wczytuje dane z pliku platnosci.csv z Google Cloud Storage lub lokalnie
     Zwraca tuple: (lista płatności, generation number dla optimistic locking)"""
@@ -607,29 +1597,196 @@ def load_platnosci() -> Tuple[List[Dict], Optional[int]]:
                 # Pobierz generation number dla optimistic locking
                 blob.reload(timeout=STORAGE_TIMEOUT)
                 generation = blob.generation
-                csv_content = blob.download_as_text(encoding='utf-8', timeout=STORAGE_TIMEOUT)
+                csv_content = download_blob_text(blob)
             finally:
                 if hasattr(signal, 'SIGALRM'):
                     signal.alarm(0)  # Wyłącz alarm
         except TimeoutError:
             logger.error("Timeout podczas pobierania platnosci.csv z Cloud Storage")
             csv_content = None
+            # Generation nie odpowiada lokalnej kopii - zapis z nią nadpisałby plik w buckecie
+            generation = None
         except Exception as e:
-            logger.error(f"Błąd podczas pobierania platnosci.csv z Cloud Storage: {e}")
             csv_content = None
+            if getattr(e, 'code', None) == 404:
+                # Pliku jeszcze nie ma w buckecie - pierwszy zapis tylko pod warunkiem, że nadal nie istnieje
+                generation = 0
+            else:
+                logger.error(f"Błąd podczas pobierania platnosci.csv z Cloud Storage: {e}")
+                generation = None
     
     # Jeśli nie udało się pobrać z Cloud Storage, spróbuj lokalnie
     if csv_content is None:
+        version = local_platnosci_version()
         if os.path.exists(PLATNOSCI_FILE):
             with open(PLATNOSCI_FILE, 'r', encoding='utf-8') as f:
                 csv_content = f.read()
         else:
             return [], None
+    else:
+        version = f"gcs:{generation}"
     
     # Parsuj CSV
     csv_io = io.StringIO(csv_content)
     reader = csv.DictReader(csv_io, delimiter=';')
-    return list(reader), generation
+    platnosci = list(reader)
+    # Każdy odczyt pełnego pliku synchronizuje indeks UID (poza lokalnym fallbackiem po błędzie GCS)
+    if not cloud_read_failed(generation):
+        platnosci_uid_index.rebuild(platnosci, version)
+    return platnosci, generation
+
+def compute_today_stats(platnosci: List[Dict]) -> Dict:
+    """Statystyki dzisiejszego dnia w strefie czasowej Polski"""
+    today_str = datetime.now(pytz.timezone('Europe/Warsaw')).strftime('%d.%m.%Y')
+    return compute_day_stats(platnosci, today_str)
+
+def compute_day_stats(platnosci: List[Dict], day_str: str) -> Dict:
+    """Oblicza liczbę, sumę i najnowszą datę transakcji z danego dnia (DD.MM.YYYY)"""
+    count = 0
+    suma = 0.0
+    latest_date = ""
+    for platnosc in platnosci:
+        data_str = platnosc.get('DATA', '').strip()
+        # Format: "DD.MM.YYYY, HH:MM:SS" lub "DD.MM.YYYY HH:MM:SS"
+        if not data_str or not data_str.startswith(day_str):
+            continue
+        count += 1
+        kwota_str = platnosc.get('KWOTA', '0').replace(',', '.')
+        try:
+            suma += float(kwota_str)
+        except ValueError:
+            pass
+        if data_str > latest_date:
+            latest_date = data_str
+    return {"count": count, "sum": suma, "latest_date": latest_date}
+
+# Strumień SSE z nowymi płatnościami
+PLATNOSCI_STREAM_BUFFER = 500  # Liczba ostatnich zdarzeń dostępnych przy wznowieniu (Last-Event-ID)
+PLATNOSCI_STREAM_QUEUE_SIZE = 100  # Maksymalna liczba zaległych zdarzeń dla jednego klienta
+PLATNOSCI_STREAM_KEEPALIVE = 15  # Sekundy między komentarzami podtrzymującymi połączenie
+
+class PlatnosciBroadcaster:
+    """Rozsyła zapisane płatności do wszystkich podłączonych klientów SSE w ramach procesu.
+    Przechowuje ostatnie zdarzenia, aby klient mógł wznowić strumień od Last-Event-ID.
+    Identyfikatory zdarzeń mają postać "<boot_id>:<numer>" - numeracja zaczyna się od nowa
+    w każdym procesie, więc identyfikator z innego procesu wymusza reset po stronie klienta."""
+
+    def __init__(self, buffer_size: int = PLATNOSCI_STREAM_BUFFER):
+        self._events = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._last_id = 0
+        self.boot_id = secrets.token_hex(8)
+
+    def event_id(self, number: int) -> str:
+        return f"{self.boot_id}:{number}"
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Zwraca numer zdarzenia z tego procesu lub None dla obcego/niepoprawnego identyfikatora"""
+        boot_id, _, number = (event_id or "").partition(":")
+        if boot_id != self.boot_id or not number.isdigit():
+            return None
+        return int(number)
+
+    def publish(self, event: str, payload: Dict):
+        """Dodaje zdarzenie do bufora i przekazuje je subskrybentom (wywoływać z pętli zdarzeń)"""
+        self._last_id += 1
+        entry = (self._last_id, event, json.dumps(payload, ensure_ascii=False))
+        self._events.append(entry)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Zbyt wolny klient - rozłącz go, po ponownym połączeniu wznowi od Last-Event-ID
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> Tuple[asyncio.Queue, List[Tuple], bool]:
+        """Rejestruje klienta. Zwraca (kolejka, zaległe zdarzenia, czy klient musi przeładować dane)"""
+        queue = asyncio.Queue(maxsize=PLATNOSCI_STREAM_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        backlog = []
+        reset = False
+        if last_event_id:
+            last_number = self.parse_event_id(last_event_id)
+            if last_number is None:
+                # Identyfikator z poprzedniego uruchomienia lub innego procesu
+                return queue, backlog, True
+            backlog = [entry for entry in self._events if entry[0] > last_number]
+            oldest_id = self._events[0][0] if self._events else self._last_id + 1
+            # Zdarzenia wypadły z bufora
+            reset = last_number < oldest_id - 1 or last_number > self._last_id
+        return queue, backlog, reset
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+platnosci_broadcaster = PlatnosciBroadcaster()
+
+def announce_platnosci(new_rows: List[Dict], platnosci: List[Dict]):
+    """Publikuje zapisane płatności wraz ze zaktualizowanymi statystykami ich dni"""
+    day_stats = {}
+    for new_row in new_rows:
+        day_str = new_row.get('DATA', '').strip()[:10]
+        if day_str not in day_stats:
+            day_stats[day_str] = compute_day_stats(platnosci, day_str)
+        platnosci_broadcaster.publish("platnosc", {
+            "platnosc": new_row,
+            "day": day_str,
+            "stats": day_stats[day_str]
+        })
+
+def announce_platnosc(new_row: Dict, platnosci: List[Dict]):
+    """Publikuje zapisaną płatność wraz ze zaktualizowanymi statystykami jej dnia"""
+    announce_platnosci([new_row], platnosci)
+
+def format_sse(entry: Tuple[int, str, str]) -> str:
+    number, event, data = entry
+    return f"id: {platnosci_broadcaster.event_id(number)}\nevent: {event}\ndata: {data}\n\n"
+
+@app.get("/api/platnosci/stream")
+async def stream_platnosci(request: Request, last_event_id: Optional[str] = None, auth: bool = Depends(require_auth)):
+    """Strumień Server-Sent Events z nowymi płatnościami i statystykami dnia - wymaga autentykacji
+    Wznawia od nagłówka Last-Event-ID (ustawianego przez EventSource) lub parametru last_event_id"""
+    if CATALOG_SNAPSHOT_PATH:
+        # Broadcaster działa w obrębie procesu - w trybie wielu workerów zapis obsłużony przez inny
+        # worker nie trafiłby do tego strumienia. 204 zamyka EventSource bez ponawiania,
+        # a frontend wraca do odświeżania statystyk po zapisie.
+        return Response(status_code=204)
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    queue, backlog, reset = platnosci_broadcaster.subscribe(last_event_id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            if reset:
+                # Klient musi pobrać aktualny stan przez /api/platnosci/stats
+                yield "event: reset\ndata: {}\n\n"
+            for entry in backlog:
+                yield format_sse(entry)
+            while not await request.is_disconnected():
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout=PLATNOSCI_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if entry is None:
+                    # Klient odłączony z powodu przepełnienia kolejki
+                    break
+                yield format_sse(entry)
+        finally:
+            platnosci_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/platnosci/save")
 async def save_platnosc(data: PlatnoscCreate, request: Request, auth: bool = Depends(require_auth)):
@@ -638,12 +1795,15 @@ async def save_platnosc(data: PlatnoscCreate, request: Request, auth: bool = Dep
     client_ip = request.client.host if request.client else "unknown"
     
     # Walidacja danych
-    if data.kwota < 0 or data.kwota > 1000000:
-        logger.warning(f"Nieprawidłowa kwota ({data.kwota}) z IP: {client_ip}")
-        raise HTTPException(status_code=400, detail="Nieprawidłowa kwota")
+    error = validate_platnosc(data)
+    if error:
+        logger.warning(f"Nieprawidłowa płatność ({error}, kwota {data.kwota}) z IP: {client_ip}")
+        raise HTTPException(status_code=400, detail=error)
     
-    if len(data.uwagi) > 1000:
-        raise HTTPException(status_code=400, detail="Uwagi zbyt długie (maksymalnie 1000 znaków)")
+    # Ponowienie już zapisanej płatności (np. po timeoucie) - sukces bez dostępu do storage
+    if data.uid in platnosci_uid_index:
+        logger.info(f"Płatność {data.uid[:50]} już zapisana - ponowienie z IP: {client_ip}")
+        return {"success": True, "message": "Płatność została już zapisana", "duplicate": True}
     
     logger.info(f"Zapisywanie płatności: {data.kwota} zł z IP: {client_ip}")
     
@@ -654,35 +1814,21 @@ async def save_platnosc(data: PlatnoscCreate, request: Request, auth: bool = Dep
         try:
             # Wczytaj istniejące płatności z generation number
             existing_platnosci, generation = load_platnosci()
+            if cloud_read_failed(generation):
+                # Zapis lokalnej kopii nadpisałby płatności w buckecie
+                raise HTTPException(status_code=503, detail="Cloud Storage jest niedostępny. Spróbuj ponownie.")
+            
+            # Płatność mogła zostać zapisana przez inną instancję lub przed konfliktem 412
+            if data.uid in platnosci_uid_index:
+                logger.info(f"Płatność {data.uid[:50]} już zapisana - ponowienie z IP: {client_ip}")
+                return {"success": True, "message": "Płatność została już zapisana", "duplicate": True}
             
             # Dodaj nową płatność
-            new_row = {
-                'UID': data.uid,
-                'DATA': data.data,
-                'BADANIA': data.badania,
-                'KWOTA': str(data.kwota).replace('.', ','),
-                'UWAGI': data.uwagi
-            }
+            new_row = platnosc_to_row(data)
             existing_platnosci.append(new_row)
             
             # Przygotuj dane do zapisu
-            output = io.StringIO()
-            writer = csv.writer(output, delimiter=';')
-            
-            # Nagłówek
-            writer.writerow(['UID', 'DATA', 'BADANIA', 'KWOTA', 'UWAGI'])
-            
-            # Wiersze danych
-            for row in existing_platnosci:
-                writer.writerow([
-                    row.get('UID', ''),
-                    row.get('DATA', ''),
-                    row.get('BADANIA', ''),
-                    row.get('KWOTA', ''),
-                    row.get('UWAGI', '')
-                ])
-            
-            csv_content = output.getvalue()
+            csv_content = serialize_platnosci(existing_platnosci)
             
             # Próbuj zapisać do Cloud Storage z optimistic locking
             storage_client = get_storage_client() if use_cloud_storage_for_csv() else None
@@ -703,7 +1849,15 @@ async def save_platnosc(data: PlatnoscCreate, request: Request, auth: bool = Dep
                         # Pierwszy zapis lub lokalny fallback
                         blob.upload_from_string(csv_content, content_type='text/csv')
                     
-                    return {"success": True, "message": "Płatność została zapisana do Cloud Storage"}
+                    bucket_cache.store(blob.name, blob.generation, csv_content.encode('utf-8'))
+                    platnosci_uid_index.add(new_row)
+                    announce_platnosc(new_row, existing_platnosci)
+                    # Statystyki w odpowiedzi - zdarzenie strumienia może trafić tylko do innej instancji
+                    return {
+                        "success": True,
+                        "message": "Płatność została zapisana do Cloud Storage",
+                        "stats": compute_today_stats(existing_platnosci)
+                    }
                 except Exception as e:
                     error_str = str(e)
                     error_code = getattr(e, 'code', None) if hasattr(e, 'code') else None
@@ -734,7 +1888,13 @@ async def save_platnosc(data: PlatnoscCreate, request: Request, auth: bool = Dep
             try:
                 with open(PLATNOSCI_FILE, 'w', encoding='utf-8') as f:
                     f.write(csv_content)
-                return {"success": True, "message": "Płatność została zapisana lokalnie"}
+                platnosci_uid_index.add(new_row)
+                announce_platnosc(new_row, existing_platnosci)
+                return {
+                    "success": True,
+                    "message": "Płatność została zapisana lokalnie",
+                    "stats": compute_today_stats(existing_platnosci)
+                }
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Błąd podczas zapisu do pliku lokalnego: {str(e)}")
         except HTTPException:
@@ -750,55 +1910,161 @@ async def save_platnosc(data: PlatnoscCreate, request: Request, auth: bool = Dep
     # Jeśli dotarliśmy tutaj, wszystkie próby się nie powiodły
     raise HTTPException(status_code=500, detail="Nie udało się zapisać płatności po kilku próbach")
 
+@app.post("/api/platnosci/save-batch")
+async def save_platnosci_batch(data: PlatnosciBatch, request: Request, auth: bool = Depends(require_auth)):
+    """Zapisuje wiele płatności jednym zapisem pliku platnosci.csv - wymaga autentykacji
+    Przeznaczone do synchronizacji kas offline i aplikacji mobilnych. Płatności z UID już obecnym
+    w pliku (lub powtórzonym w żądaniu) są pomijane jako duplikaty. Zwraca wynik dla każdej pozycji."""
+    client_ip = request.client.host if request.client else "unknown"
+    
+    if len(data.platnosci) > MAX_PLATNOSCI_BATCH:
+        logger.warning(f"Próba zapisu zbyt dużej liczby płatności ({len(data.platnosci)}) z IP: {client_ip}")
+        raise HTTPException(status_code=400, detail=f"Zbyt duża liczba płatności (maksymalnie {MAX_PLATNOSCI_BATCH})")
+    
+    # Walidacja i deduplikacja w obrębie żądania
+    results = []
+    candidates = []  # (indeks wyniku, płatność)
+    seen_uids = set()
+    for item in data.platnosci:
+        if not isinstance(item, dict):
+            results.append({"uid": None, "status": "invalid", "detail": "Pozycja nie jest obiektem"})
+            continue
+        try:
+            platnosc = PlatnoscCreate.parse_obj(item)
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+            results.append({"uid": item.get("uid"), "status": "invalid", "detail": detail})
+            continue
+        uid = platnosc.uid.strip()
+        error = "Brak UID" if not uid else validate_platnosc(platnosc)
+        if error:
+            results.append({"uid": platnosc.uid, "status": "invalid", "detail": error})
+        elif uid in seen_uids or uid in platnosci_uid_index:
+            results.append({"uid": platnosc.uid, "status": "duplicate"})
+        else:
+            seen_uids.add(uid)
+            results.append({"uid": platnosc.uid, "status": "pending"})
+            candidates.append((len(results) - 1, platnosc))
+    
+    logger.info(f"Zapisywanie {len(candidates)} z {len(data.platnosci)} płatności (batch) z IP: {client_ip}")
+    
+    def summary(message: str) -> Dict:
+        counts = Counter(result["status"] for result in results)
+        return {
+            "success": True,
+            "message": message,
+            "saved": counts["saved"],
+            "duplicates": counts["duplicate"],
+            "invalid": counts["invalid"],
+            "results": results
+        }
+    
+    if not candidates:
+        return summary("Brak nowych płatności do zapisu")
+    
+    max_retries = 5
+    retry_count = 0
+    
+    while retry_count < max_retries:
+        try:
+            # Wczytaj istniejące płatności z generation number (odświeża indeks UID)
+            existing_platnosci, generation = load_platnosci()
+            if cloud_read_failed(generation):
+                # Zapis lokalnej kopii nadpisałby płatności w buckecie
+                raise HTTPException(status_code=503, detail="Cloud Storage jest niedostępny. Spróbuj ponownie.")
+            
+            # Płatności mogły zostać zapisane przez inną instancję lub przed konfliktem 412
+            new_rows = []
+            for result_index, platnosc in candidates:
+                if platnosc.uid in platnosci_uid_index:
+                    results[result_index]["status"] = "duplicate"
+                else:
+                    results[result_index]["status"] = "pending"
+                    new_rows.append(platnosc_to_row(platnosc))
+            
+            if not new_rows:
+                return summary("Brak nowych płatności do zapisu")
+            
+            existing_platnosci.extend(new_rows)
+            csv_content = serialize_platnosci(existing_platnosci)
+            
+            # Próbuj zapisać do Cloud Storage z optimistic locking - jeden zapis dla całego batcha
+            saved_to = None
+            storage_client = get_storage_client() if use_cloud_storage_for_csv() else None
+            if storage_client:
+                try:
+                    bucket = storage_client.bucket(BUCKET_NAME)
+                    blob = bucket.blob(PLATNOSCI_FILE_NAME)
+                    
+                    if generation is not None:
+                        blob.upload_from_string(
+                            csv_content, 
+                            content_type='text/csv',
+                            if_generation_match=generation
+                        )
+                    else:
+                        blob.upload_from_string(csv_content, content_type='text/csv')
+                    bucket_cache.store(blob.name, blob.generation, csv_content.encode('utf-8'))
+                    saved_to = "do Cloud Storage"
+                except Exception as e:
+                    error_str = str(e)
+                    error_code = getattr(e, 'code', None) if hasattr(e, 'code') else None
+                    # Sprawdź czy to błąd generation mismatch (412 Precondition Failed)
+                    if (error_code == 412 or 
+                        "412" in error_str or 
+                        "Precondition" in error_str or 
+                        "generation" in error_str.lower() or
+                        "conditionNotMet" in error_str):
+                        # Plik został zmieniony przez innego użytkownika - spróbuj ponownie
+                        retry_count += 1
+                        if retry_count < max_retries:
+                            time.sleep(0.1 * retry_count)  # Exponential backoff
+                            continue
+                        else:
+                            raise HTTPException(
+                                status_code=409, 
+                                detail="Plik został zmieniony przez innego użytkownika. Spróbuj ponownie."
+                            )
+                    else:
+                        # Lokalny plik na Cloud Run nie przetrwa restartu - urządzenie musi ponowić zapis
+                        logger.error(f"Błąd podczas zapisu do Cloud Storage: {e}")
+                        raise HTTPException(status_code=503, detail="Nie udało się zapisać płatności do Cloud Storage. Spróbuj ponownie.")
+            
+            # Bez Cloud Storage (tryb development) zapisz lokalnie
+            if saved_to is None:
+                try:
+                    with open(PLATNOSCI_FILE, 'w', encoding='utf-8') as f:
+                        f.write(csv_content)
+                    saved_to = "lokalnie"
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"Błąd podczas zapisu do pliku lokalnego: {str(e)}")
+            
+            for row in new_rows:
+                platnosci_uid_index.add(row)
+            for result in results:
+                if result["status"] == "pending":
+                    result["status"] = "saved"
+            announce_platnosci(new_rows, existing_platnosci)
+            return summary(f"Zapisano {len(new_rows)} płatności {saved_to}")
+        except HTTPException:
+            raise
+        except Exception as e:
+            if retry_count < max_retries - 1:
+                retry_count += 1
+                time.sleep(0.1 * retry_count)
+                continue
+            raise HTTPException(status_code=400, detail=f"Błąd podczas zapisu płatności: {str(e)}")
+    
+    # Jeśli dotarliśmy tutaj, wszystkie próby się nie powiodły
+    raise HTTPException(status_code=500, detail="Nie udało się zapisać płatności po kilku próbach")
+
 @app.get("/api/platnosci/stats")
 async def get_daily_stats(auth: bool = Depends(require_auth)):
     """Zwraca statystyki transakcji z dzisiejszego dnia - wymaga autentykacji"""
     try:
         # Wczytaj wszystkie płatności (ignoruj generation number dla odczytu)
         platnosci, _ = load_platnosci()
-        
-        # Pobierz dzisiejszą datę w strefie czasowej Polski (DD.MM.YYYY)
-        poland_tz = pytz.timezone('Europe/Warsaw')
-        today = datetime.now(poland_tz)
-        today_str = today.strftime('%d.%m.%Y')
-        
-        # Filtruj transakcje z dzisiejszego dnia
-        today_platnosci = []
-        for platnosc in platnosci:
-            data_str = platnosc.get('DATA', '').strip()
-            if not data_str:
-                continue
-            
-            # Sprawdź czy data zaczyna się od dzisiejszej daty (może być z godziną)
-            # Format: "DD.MM.YYYY, HH:MM:SS" lub "DD.MM.YYYY HH:MM:SS"
-            if data_str.startswith(today_str):
-                today_platnosci.append(platnosc)
-        
-        # Oblicz sumę i znajdź najnowszą transakcję
-        suma = 0.0
-        latest_date = None
-        
-        for platnosc in today_platnosci:
-            kwota_str = platnosc.get('KWOTA', '0').replace(',', '.')
-            try:
-                suma += float(kwota_str)
-            except ValueError:
-                pass
-            
-            # Znajdź najnowszą datę
-            data_str = platnosc.get('DATA', '').strip()
-            if data_str and (latest_date is None or data_str > latest_date):
-                latest_date = data_str
-        
-        # Jeśli nie ma transakcji z dzisiaj, latest_date powinno być puste
-        if not today_platnosci:
-            latest_date = ""
-        
-        return {
-            "count": len(today_platnosci),
-            "sum": suma,
-            "latest_date": latest_date or ""
-        }
+        return compute_today_stats(platnosci)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania statystyk: {str(e)}")
 
@@ -844,7 +2110,69 @@ async def get_platnosci_by_date(date: str, auth: bool = Depends(require_auth)):
         logger.error(f"Błąd podczas pobierania transakcji: {e}")
         raise HTTPException(status_code=500, detail="Błąd podczas pobierania transakcji")
 
+@app.get("/api/platnosci/{uid}")
+async def get_platnosc(uid: str, auth: bool = Depends(require_auth)):
+    """Zwraca pojedynczą płatność po UID z indeksu w pamięci - wymaga autentykacji"""
+    if not uid.strip() or len(uid) > 100:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy UID")
+    platnosc = platnosci_uid_index.get(uid)
+    if platnosc is None:
+        # Indeks mógł nie zobaczyć zapisu z innej instancji - odśwież go tylko, gdy plik się zmienił
+        version = current_platnosci_version()
+        if version is not None and version != platnosci_uid_index.version:
+            load_platnosci()
+            platnosc = platnosci_uid_index.get(uid)
+    if platnosc is None:
+        raise HTTPException(status_code=404, detail="Nie znaleziono płatności")
+    return {"platnosc": platnosc}
+
+@app.get("/api/admin/admission")
+async def get_admission_stats(auth: bool = Depends(require_auth)):
+    """Zwraca stan kontroli dopuszczania: zajęte miejsca, kolejki i czasy oczekiwania - wymaga autentykacji"""
+    return {
+        "enabled": ADMISSION_CONTROL,
+        "classes": {c.name: c.stats() for c in admission_controller.classes}
+    }
+
+@app.get("/api/admin/profiles")
+async def list_profiles(auth: bool = Depends(require_auth)):
+    """Zwraca listę ostatnich profili żądań (bez stosów) - wymaga autentykacji"""
+    return {
+        "profiles": [
+            {key: value for key, value in profile.items() if key != "stacks"}
+            for profile in reversed(recent_profiles)
+        ]
+    }
+
+@app.get("/api/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: int, auth: bool = Depends(require_auth)):
+    """Zwraca profil w formacie 'folded' (flamegraph.pl, speedscope, inferno) - wymaga autentykacji"""
+    for profile in recent_profiles:
+        if profile["id"] == profile_id:
+            return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
+    raise HTTPException(status_code=404, detail="Nie znaleziono profilu")
+
+@app.on_event("startup")
+async def build_platnosci_uid_index():
+    """Odbudowuje indeks UID z pliku platnosci.csv przy starcie aplikacji"""
+    try:
+        load_platnosci()
+        logger.info(f"Zbudowano indeks UID płatności ({len(platnosci_uid_index)} pozycji)")
+    except Exception as e:
+        logger.error(f"Błąd podczas budowania indeksu UID płatności: {e}")
+
+@app.on_event("startup")
+async def start_catalog_refresher():
+    """W trybie współdzielonego snapshotu uruchamia wątek odświeżający katalog"""
+    if CATALOG_SNAPSHOT_PATH:
+        threading.Thread(target=catalog_refresher, daemon=True).start()
+
+@app.on_event("shutdown")
+async def flush_logs():
+    """Zatrzymuje wątek logowania, dopisując rekordy pozostałe w kolejce"""
+    log_listener.stop()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    uvicorn.run(app, host="0.0.0.0", port=8080, access_log=False)
 